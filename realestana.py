@@ -1,33 +1,99 @@
 import streamlit as st
 import numpy as np
-import numpy_financial as npf
 import json
+import math
 
 # Function to calculate mortgage payment
+@st.cache_data
 def calculate_mortgage_payment(loan_amount, monthly_interest, num_payments):
     if monthly_interest == 0:
         return loan_amount / num_payments
-    return loan_amount * (monthly_interest * (1 + monthly_interest) ** num_payments) / ((1 + monthly_interest) ** num_payments - 1)
+    # expm1/log1p keep (1 + r) ** n - 1 accurate for very small rates
+    growth_minus_one = math.expm1(num_payments * math.log1p(monthly_interest))
+    return loan_amount * monthly_interest * (growth_minus_one + 1) / growth_minus_one
+
+# Function to solve for the periodic IRR of an annuity with Newton's method
+def irr_annuity(price, cash_flow, num_payments, r0=0.01):
+    r = r0
+    for _ in range(50):
+        one_minus_discount = -math.expm1(-num_payments * math.log1p(r))
+        annuity_factor = one_minus_discount / r
+        # Newton on log(PV / price), which stays close to linear in r even for negative IRRs
+        log_ratio = math.log(cash_flow * annuity_factor / price)
+        if abs(log_ratio) < 1e-12:
+            return r
+        d_annuity_factor = (num_payments * (1 - one_minus_discount) / (1 + r) - annuity_factor) / r
+        step = log_ratio * annuity_factor / d_annuity_factor
+        r = r - step if r - step > -1 else (r - 1) / 2  # Stay above a -100% rate
+    raise ValueError("IRR did not converge")
 
 # Function to calculate IRR
+@st.cache_data
 def calculate_irr(price, rent, total_expenses, loan_amount, loan_term, interest_rate):
     try:
-        cash_flows = [-price] + [(rent - total_expenses - (loan_amount * (interest_rate / 12))) for _ in range(loan_term * 12)]
-        irr = npf.irr(cash_flows)
-        return irr * 100  # Return as percentage
+        # Every period after the purchase has the same cash flow, so the IRR is the
+        # root of the annuity NPV rather than of a full cash-flow polynomial
+        cash_flow = rent - total_expenses - (loan_amount * (interest_rate / 12))
+        num_payments = loan_term * 12
+        if cash_flow <= 0:
+            return 0
+        if cash_flow * num_payments == price:
+            return 0  # The cash flows exactly recover the price
+        irr = irr_annuity(price, cash_flow, num_payments)
+        return irr * 1200  # Return as annual percentage
     except Exception as e:
         return 0  # Handle any potential errors by returning 0 for IRR
 
 # Function to calculate payback period
+@st.cache_data
 def calculate_payback_period(down_payment, cash_flow):
     if cash_flow > 0:
         return down_payment / cash_flow
     return float('inf')  # Return infinity if cash_flow is negative
 
+# Function to divide, returning 0 when the denominator is not positive
+def safe_div(numerator, denominator):
+    return numerator / denominator if denominator > 0 else 0.0
+
 # Function to calculate tax benefits
 def calculate_tax_benefits(depreciation, interest_deduction):
     return depreciation + interest_deduction
 
+# Function to build the sensitivity grids
+@st.cache_data
+def sensitivity_grids(interest_rate, rent_income):
+    return np.linspace(interest_rate - 2, interest_rate + 2, 5), np.linspace(rent_income * 0.8, rent_income * 1.2, 5)
+
+# Function to build the sensitivity table
+@st.cache_data
+def sensitivity_table(interest_rates, rent_values, operating_expenses, property_tax, loan_amount, loan_term):
+    import pandas as pd  # Imported on first use to keep app start-up light
+
+    num_payments = loan_term * 12
+    # The mortgage payment only depends on the rate and NOI only on the rent, so
+    # evaluate each along its own axis and broadcast them into the rate x rent grid
+    monthly_interest = interest_rates / 100 / 12
+    with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+        growth_minus_one = np.expm1(num_payments * np.log1p(monthly_interest))
+        mortgage_payment = np.where(monthly_interest == 0, loan_amount / num_payments, loan_amount * monthly_interest * (growth_minus_one + 1) / growth_minus_one)
+    if not np.isfinite(mortgage_payment).all():
+        raise ValueError("Mortgage payment is out of range for the given interest rate and loan term")
+    noi = rent_values * 12 - ((operating_expenses * 12) + property_tax)
+    cash_flow = noi[np.newaxis, :] - mortgage_payment[:, np.newaxis] * 12
+    return pd.DataFrame({
+        "Interest Rate (%)": np.repeat(interest_rates, rent_values.size),
+        "Rent ($)": np.tile(rent_values, interest_rates.size),
+        "NOI ($)": np.tile(noi, interest_rates.size),
+        "Cash Flow ($)": cash_flow.ravel(),
+    })
+
+# Function to calculate scenario metrics
+@st.cache_data
+def scenario_metrics(adjusted_rent, adjusted_expenses, property_tax, annual_debt_service):
+    adjusted_noi = adjusted_rent * 12 - (adjusted_expenses * 12 + property_tax)
+    adjusted_cash_flow = adjusted_noi - annual_debt_service
+    return adjusted_noi, adjusted_cash_flow
+
 # Streamlit App
 def main():
     st.title("Real Estate Deal Analyzer")
@@ -38,50 +104,65 @@ def main():
     # Property Input Tab
     with tabs[0]:
         st.header("Property Input")
-        property_price = st.number_input("Property Price ($):", min_value=0.0, value=100000.0, step=1000.0)
-        rent_income = st.number_input("Monthly Rent Income ($):", min_value=0.0, value=1000.0, step=100.0)
-        operating_expenses = st.number_input("Operating Expenses ($/month):", min_value=0.0, value=200.0, step=50.0)
-        property_tax = st.number_input("Property Tax ($/year):", min_value=0.0, value=1200.0, step=100.0)
-        loan_amount = st.number_input("Loan Amount ($):", min_value=0.0, value=80000.0, step=1000.0)
-        down_payment = st.number_input("Down Payment ($):", min_value=0.0, value=20000.0, step=1000.0)
-        interest_rate = st.number_input("Interest Rate (%):", min_value=0.0, value=5.0, step=0.1)
-        loan_term = st.number_input("Loan Term (years):", min_value=1, value=30, step=1)
-        num_units = st.number_input("Number of Units:", min_value=1, value=1, step=1)
-        depreciation = st.number_input("Annual Depreciation ($):", min_value=0.0, value=5000.0, step=100.0)
-        interest_deduction = st.number_input("Annual Interest Deduction ($):", min_value=0.0, value=4000.0, step=100.0)
+        with st.form("property_inputs"):
+            property_price = st.number_input("Property Price ($):", min_value=0.0, value=100000.0, step=1000.0)
+            rent_income = st.number_input("Monthly Rent Income ($):", min_value=0.0, value=1000.0, step=100.0)
+            operating_expenses = st.number_input("Operating Expenses ($/month):", min_value=0.0, value=200.0, step=50.0)
+            property_tax = st.number_input("Property Tax ($/year):", min_value=0.0, value=1200.0, step=100.0)
+            loan_amount = st.number_input("Loan Amount ($):", min_value=0.0, value=80000.0, step=1000.0)
+            down_payment = st.number_input("Down Payment ($):", min_value=0.0, value=20000.0, step=1000.0)
+            interest_rate = st.number_input("Interest Rate (%):", min_value=0.0, value=5.0, step=0.1)
+            loan_term = st.number_input("Loan Term (years):", min_value=1, value=30, step=1)
+            num_units = st.number_input("Number of Units:", min_value=1, value=1, step=1)
+            depreciation = st.number_input("Annual Depreciation ($):", min_value=0.0, value=5000.0, step=100.0)
+            interest_deduction = st.number_input("Annual Interest Deduction ($):", min_value=0.0, value=4000.0, step=100.0)
+            submitted = st.form_submit_button("Apply")
+        if submitted:
+            st.session_state['inputs_applied'] = True
+    inputs_applied = st.session_state.get('inputs_applied', False)
+
+    # Calculate Mortgage Payment once per rerun and share it across tabs
+    mortgage_ok = True
+    try:
+        monthly_interest = interest_rate / 100 / 12
+        num_payments = loan_term * 12
+        mortgage_payment = calculate_mortgage_payment(loan_amount, monthly_interest, num_payments)
+        annual_debt_service = mortgage_payment * 12
+    except Exception as e:
+        mortgage_ok = False
+        with tabs[0]:
+            st.error(f"An error occurred: {str(e)}")
 
     # Analysis Results Tab
     with tabs[1]:
         st.header("Analysis Results")
-        calculate_metrics_button = st.button("Calculate Metrics", key="calc_metrics")
+        if not inputs_applied:
+            st.info("Click Apply on the Property Input tab to enable the analyses.")
+        calculate_metrics_button = st.button("Calculate Metrics", key="calc_metrics", disabled=not inputs_applied or not mortgage_ok)
+        if not mortgage_ok:
+            st.warning("The mortgage payment could not be calculated. Check the interest rate and loan term on the Property Input tab.")
         if calculate_metrics_button:
             try:
                 # Extract Input Values
                 rent = rent_income * 12  # Annual Rent
                 expenses = operating_expenses * 12  # Annual Expenses
-                monthly_interest = interest_rate / 100 / 12
-                num_payments = loan_term * 12
-
-                # Calculate Mortgage Payment
-                mortgage_payment = calculate_mortgage_payment(loan_amount, monthly_interest, num_payments)
-                annual_debt_service = mortgage_payment * 12
 
                 # Calculate Key Metrics
                 total_expenses = expenses + property_tax
                 noi = rent - total_expenses
                 cash_flow = noi - annual_debt_service
-                cap_rate = (noi / property_price) * 100 if property_price > 0 else 0
-                dcr = noi / annual_debt_service if annual_debt_service > 0 else 0
-                cash_on_cash_return = (cash_flow / down_payment) * 100 if down_payment > 0 else 0
-                ltv = (loan_amount / property_price) * 100 if property_price > 0 else 0
-                opex_ratio = (total_expenses / rent) * 100 if rent > 0 else 0
-                cash_flow_per_unit = cash_flow / num_units if num_units > 0 else 0
+                cap_rate = safe_div(noi, property_price) * 100
+                dcr = safe_div(noi, annual_debt_service)
+                cash_on_cash_return = safe_div(cash_flow, down_payment) * 100
+                ltv = safe_div(loan_amount, property_price) * 100
+                opex_ratio = safe_div(total_expenses, rent) * 100
+                cash_flow_per_unit = safe_div(cash_flow, num_units)
 
                 # Advanced Metrics
                 irr = calculate_irr(property_price, rent, total_expenses, loan_amount, loan_term, interest_rate / 100)
                 payback_period = calculate_payback_period(down_payment, cash_flow)
                 tax_benefits = calculate_tax_benefits(depreciation, interest_deduction)
-                break_even_rent = (total_expenses + annual_debt_service) / num_units / 12 if num_units > 0 else 0
+                break_even_rent = safe_div(total_expenses + annual_debt_service, num_units) / 12
 
                 # Display Results
                 st.write(f"Net Operating Income (NOI): ${noi:,.2f}")
@@ -105,20 +186,17 @@ def main():
     # Scenario Analysis Tab
     with tabs[2]:
         st.header("Scenario Analysis")
+        if not inputs_applied:
+            st.info("Click Apply on the Property Input tab to enable the analyses.")
         adjusted_rent = st.slider("Adjusted Monthly Rent Income ($):", min_value=0, max_value=10000, value=int(rent_income), step=100, key="adjusted_rent")
         adjusted_expenses = st.slider("Adjusted Operating Expenses ($/month):", min_value=0, max_value=5000, value=int(operating_expenses), step=50, key="adjusted_expenses")
-        calculate_scenario_metrics_button = st.button("Calculate Scenario Metrics", key="calc_scenario")
+        calculate_scenario_metrics_button = st.button("Calculate Scenario Metrics", key="calc_scenario", disabled=not inputs_applied or not mortgage_ok)
+        if not mortgage_ok:
+            st.warning("The mortgage payment could not be calculated. Check the interest rate and loan term on the Property Input tab.")
         if calculate_scenario_metrics_button:
             try:
                 # Calculate Scenario Metrics
-                adjusted_annual_rent = adjusted_rent * 12
-                adjusted_annual_expenses = adjusted_expenses * 12
-                monthly_interest = interest_rate / 100 / 12
-                num_payments = loan_term * 12
-                mortgage_payment = calculate_mortgage_payment(loan_amount, monthly_interest, num_payments)
-                annual_debt_service = mortgage_payment * 12
-                adjusted_noi = adjusted_annual_rent - (adjusted_annual_expenses + property_tax)
-                adjusted_cash_flow = adjusted_noi - annual_debt_service
+                adjusted_noi, adjusted_cash_flow = scenario_metrics(adjusted_rent, adjusted_expenses, property_tax, annual_debt_service)
                 st.write(f"Scenario Net Operating Income (NOI): ${adjusted_noi:,.2f}")
                 st.write(f"Scenario Annual Cash Flow: ${adjusted_cash_flow:,.2f}")
             except Exception as e:
@@ -127,22 +205,17 @@ def main():
     # Sensitivity Analysis Tab
     with tabs[3]:
         st.header("Sensitivity Analysis")
-        interest_rates = np.linspace(interest_rate - 2, interest_rate + 2, 5)
-        rent_values = np.linspace(rent_income * 0.8, rent_income * 1.2, 5)
-        perform_sensitivity_analysis_button = st.button("Perform Sensitivity Analysis", key="sensitivity_analysis")
+        if not inputs_applied:
+            st.info("Click Apply on the Property Input tab to enable the analyses.")
+        perform_sensitivity_analysis_button = st.button("Perform Sensitivity Analysis", key="sensitivity_analysis", disabled=not inputs_applied)
         if perform_sensitivity_analysis_button:
             try:
-                sensitivity_results = []
-                for rate in interest_rates:
-                    for rent in rent_values:
-                        adjusted_rent = rent * 12
-                        total_expenses = (operating_expenses * 12) + property_tax
-                        mortgage_payment = calculate_mortgage_payment(loan_amount, rate / 100 / 12, loan_term * 12)
-                        annual_debt_service = mortgage_payment * 12
-                        noi = adjusted_rent - total_expenses
-                        cash_flow = noi - annual_debt_service
-                        sensitivity_results.append(f"Interest Rate: {rate:.2f}%, Rent: ${rent:,.2f} -> NOI: ${noi:,.2f}, Cash Flow: ${cash_flow:,.2f}")
-                st.write("\n\n".join(sensitivity_results))
+                interest_rates, rent_values = sensitivity_grids(interest_rate, rent_income)
+                sensitivity_df = sensitivity_table(interest_rates, rent_values, operating_expenses, property_tax, loan_amount, loan_term)
+                st.dataframe(
+                    sensitivity_df.style.format("${:,.2f}").format("{:.2f}%", subset=["Interest Rate (%)"]),
+                    hide_index=True,
+                )
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
 